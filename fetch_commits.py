@@ -1,13 +1,14 @@
 #!/usr/bin/env python3
 """
-fetch_commits.py — автономный сборщик статистики с PAT (5 000 req/ч) и накоплением истории:
+fetch_commits.py — автономный сборщик статистики с PAT (5 000 req/ч) и накоплением истории:
 
 • Читает ton_repos.json (организации или owner/repo)
-• Хранит единый кэш cache.json для incremental fetch (commits/issues/orgs/repos)
+• Хранит кэш в SQLite (cache.db) для incremental fetch (commits/issues/orgs/repos)
 • При первом запуске делает полный дамп всех репо
 • Далее инкрементально добавляет только новые коммиты, issue и PR
 • Возвращает только имена изменённых файлов (с расширениями)
 • Логирует прогресс по страницам и репозиториям
+• Качает репозитории параллельно через httpx (HTTP/2) + asyncio.gather
 • Объединяет старый leaderboard.json с новыми записями и сохраняет его
 • Пишет итог в leaderboard.json
 
@@ -18,56 +19,267 @@ import os
 import sys
 import time
 import json
-import requests
+import random
+import re
+import asyncio
 import pathlib
+import sqlite3
 
-from collections import defaultdict
-from urllib.parse import urlparse
+import httpx
+import ijson
+import orjson
+
+from collections import deque
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlencode
 
 # === config ===
 REPOS_FILE  = "ton_repos.json"
-CACHE_FILE  = "cache.json"
+CACHE_FILE  = "cache.json"  # legacy, мигрирует в CACHE_DB при первом запуске
+CACHE_DB    = "cache.db"
 OUTPUT_FILE = "leaderboard.json"
 PER_PAGE    = 100
-ORG_TTL     = 7 * 24 * 3600  # 7 дней
+ORG_TTL     = 24 * 3600  # сутки: проверка по ETag почти бесплатна
+SINCE_OVERLAP = 900  # сек перекрытия курсора since — события во время обхода не теряются
+REPO_CONCURRENCY = 20  # одновременно обрабатываемых репозиториев
+CHECKPOINT_EVERY = 25  # репозиториев между контрольными точками персиста
+AIMD_START, AIMD_MIN, AIMD_MAX = 10, 2, 32  # окно одновременных запросов
+AIMD_TARGET = 0.4   # целевая средняя латентность, сек
+AIMD_WINDOW = 32    # ответов между пересмотрами окна
+MAX_RETRIES = 8     # попыток на один URL при rate limit
+
+# https://github.com/owner/repo(.git) → owner/repo
+_URL_RE = re.compile(r"^https?://[^/]+/(?P<path>[^?#]+?)(?:\.git)?/?$")
+_LINK_NEXT_RE = re.compile(r'<[^>]+>;\s*rel="next"')
+_LINK_LAST_RE = re.compile(r'<[^>]*[?&]page=(\d+)[^>]*>;\s*rel="last"')
+
+
+def _has_next(headers) -> bool:
+    """GitHub отдаёт Link: <...>; rel="next" пока есть следующая страница."""
+    return bool(_LINK_NEXT_RE.search(headers.get("Link", "")))
+
+
+def _last_page(headers) -> int:
+    """Номер последней страницы из Link: rel="last" (0, если неизвестен)."""
+    m = _LINK_LAST_RE.search(headers.get("Link", ""))
+    return int(m.group(1)) if m else 0
+
+
+class AIMDLimiter:
+    """Адаптивное окно одновременных запросов (additive increase / multiplicative decrease):
+    +1 слот, пока средняя латентность в норме; окно пополам при 429/secondary limit."""
+
+    def __init__(self, start=AIMD_START, lo=AIMD_MIN, hi=AIMD_MAX,
+                 target=AIMD_TARGET, window=AIMD_WINDOW):
+        self.limit, self.lo, self.hi, self.target = start, lo, hi, target
+        self.active = 0
+        self._lat = deque(maxlen=window)
+        self._cond = asyncio.Condition()
+
+    async def __aenter__(self):
+        async with self._cond:
+            while self.active >= self.limit:
+                await self._cond.wait()
+            self.active += 1
+
+    async def __aexit__(self, *exc):
+        async with self._cond:
+            self.active -= 1
+            self._cond.notify_all()
+
+    async def record(self, latency: float):
+        self._lat.append(latency)
+        if len(self._lat) < self._lat.maxlen:
+            return
+        mean = sum(self._lat) / len(self._lat)
+        self._lat.clear()
+        if mean <= self.target:
+            if self.limit < self.hi:
+                async with self._cond:
+                    self.limit += 1
+                    self._cond.notify_all()
+        else:
+            await self._halve()
+
+    async def throttled(self):
+        self._lat.clear()
+        await self._halve()
+
+    async def _halve(self):
+        async with self._cond:
+            new = max(self.lo, self.limit // 2)
+            if new != self.limit:
+                log("warn", f"AIMD: window {self.limit} → {new}")
+                self.limit = new
+
+
+LIMITER = AIMDLimiter()
+
+# ETag по полному URL (с query): 304 Not Modified не тратит rate limit.
+# Сюда попадают только ETag уже влитых данных: обход репозитория копит их
+# в локальном словаре и публикует вместе с записями и курсором — иначе
+# контрольная точка могла бы сохранить ETag страницы, чьи данные пропали
+# при падении, и следующий запуск получил бы 304 вместо недобранной истории.
+ETAGS: dict = {}
 
 
-def safe_get(url, **kw):
-    backoff = 1
+def _retry_after(headers, default: float) -> float:
+    """Retry-After по RFC 7231 — либо секунды, либо HTTP-дата."""
+    v = headers.get("Retry-After")
+    if v is None:
+        return default
+    try:
+        return max(0.0, float(v))
+    except ValueError:
+        try:
+            return max(0.0, parsedate_to_datetime(v).timestamp() - time.time())
+        except Exception:
+            return default
+
+
+def _etag_key(url: str, params) -> str:
+    """Ключ без since: курсор сдвигается каждый запуск, и ETag с ним в ключе
+    никогда бы не совпал снова — только копил бы мёртвые строки в etags.
+    Без since ключ стабилен, а 304 по-прежнему корректен: он означает «тело
+    совпадает с уже влитым ответом», то есть нового ничего нет."""
+    if params:
+        params = {k: v for k, v in params.items() if k != "since"}
+    return f"{url}?{urlencode(sorted(params.items()))}" if params else url
+
+
+async def safe_get(client, url, etags=ETAGS, **kw):
+    """GET с ретраями и conditional-запросами. etags — куда складывать ETag
+    успешных ответов (по умолчанию глобальный словарь; отдельный словарь —
+    для отложенной публикации, None — вообще без conditional-логики)."""
+    backoff, retries = 1, 0
+    key = _etag_key(url, kw.get("params"))
+    etag = (etags.get(key) or ETAGS.get(key)) if etags is not None else None
+    if etag:
+        kw["headers"] = {**kw.get("headers", {}), "If-None-Match": etag}
     while True:
-        r = requests.get(url, **kw)
+        async with LIMITER:
+            t0 = time.monotonic()
+            r = await client.get(url, **kw)
         if r.status_code in (429, 403):
             msg = ""
             if r.headers.get("Content-Type", "").startswith("application/json"):
                 try:
-                    msg = r.json().get("message", "").lower()
+                    msg = orjson.loads(r.content).get("message", "").lower()
                 except Exception:
                     pass
             # secondary rate limit
             if "secondary rate limit" in msg or "rate limit exceeded" in msg:
-                retry = int(r.headers.get("Retry-After", backoff))
-                log("warn", f"Rate limit on {url}, sleeping {retry}s")
-                time.sleep(retry)
+                retries += 1
+                if retries > MAX_RETRIES:
+                    raise RuntimeError(f"Giving up on {url} after {MAX_RETRIES} rate-limit retries")
+                wait = _retry_after(r.headers, backoff) + random.uniform(0, backoff * 0.25)
+                log("warn", f"Rate limit on {url}, sleeping {wait:.1f}s")
+                await LIMITER.throttled()
+                await asyncio.sleep(wait)
                 backoff = min(backoff * 2, 60)
                 continue
             # other forbidden
             if r.status_code == 403:
                 raise RuntimeError(f"403 Forbidden {url} → {msg or 'permission denied'}")
             # too many requests
-            retry = int(r.headers.get("Retry-After", backoff))
-            log("warn", f"429 Too Many Requests on {url}, sleeping {retry}s")
-            time.sleep(retry)
+            retries += 1
+            if retries > MAX_RETRIES:
+                raise RuntimeError(f"Giving up on {url} after {MAX_RETRIES} rate-limit retries")
+            wait = _retry_after(r.headers, backoff) + random.uniform(0, backoff * 0.25)
+            log("warn", f"429 Too Many Requests on {url}, sleeping {wait:.1f}s")
+            await LIMITER.throttled()
+            await asyncio.sleep(wait)
+            backoff = min(backoff * 2, 60)
+            continue
+        # transient server errors: ретраим, иначе вызывающий код молча оборвёт пагинацию
+        if r.status_code in (500, 502, 503, 504):
+            retries += 1
+            if retries > MAX_RETRIES:
+                raise RuntimeError(f"Giving up on {url} after {MAX_RETRIES} retries (HTTP {r.status_code})")
+            wait = _retry_after(r.headers, backoff) + random.uniform(0, backoff * 0.25)
+            log("warn", f"{r.status_code} on {url}, retrying in {wait:.1f}s")
+            await asyncio.sleep(wait)
             backoff = min(backoff * 2, 60)
             continue
+        await LIMITER.record(time.monotonic() - t0)
+        if etags is not None and r.status_code == 200 and "ETag" in r.headers:
+            etags[key] = r.headers["ETag"]
+        await _pace(r.headers)
         return r
 
 
+async def _pace(headers):
+    """Пауза по заголовкам X-RateLimit-*: при малом остатке размазываем
+    оставшиеся запросы по окну до reset вместо простоя до самого reset."""
+    try:
+        remaining = int(headers.get("X-RateLimit-Remaining", "5000"))
+        limit = int(headers.get("X-RateLimit-Limit", "5000"))
+        reset = int(headers.get("X-RateLimit-Reset", "0"))
+    except ValueError:
+        return
+    if remaining > max(50, limit // 10):
+        return
+    window = max(0.0, reset - time.time())
+    if remaining <= 0:
+        log("warn", f"Rate budget exhausted, sleeping {window:.0f}s until reset")
+        await asyncio.sleep(window)
+    else:
+        await asyncio.sleep(min(window / remaining, 30.0))
+
+
+async def paginate(client, url: str, params: dict, label: str, etags=ETAGS):
+    """Генератор страниц списочного API: отдаёт распарсенные страницы по порядку.
+
+    Обычный режим — страница за страницей по Link: rel="next" (ранний выход
+    вызывающего кода закрывает генератор). На полном дампе (без since) после
+    первой страницы известен rel="last" — остальные страницы качаются одним
+    asyncio.gather вместо последовательной цепочки запросов."""
+    params = {**params, "per_page": PER_PAGE}
+    full_dump = "since" not in params
+    page = 1
+    while True:
+        r = await safe_get(client, url, etags=etags, params={**params, "page": page})
+        if r.status_code == 304:
+            log("info", f"{label}: page {page} not modified")
+            return
+        if not r.is_success:
+            log("warn", f"{label}: HTTP {r.status_code}, stopping")
+            return
+        data = orjson.loads(r.content)
+        cnt = len(data) if isinstance(data, list) else 0
+        log("info", f"{label}: page {page}: got {cnt}")
+        if not data:
+            return
+        yield data
+        if not _has_next(r.headers):
+            return
+        if full_dump and page == 1 and (last := _last_page(r.headers)) > 1:
+            # тела этих страниц нужны безусловно — 304 тут дал бы пустой ответ
+            # вместо данных, так что conditional-логику не используем
+            resps = await asyncio.gather(*(
+                safe_get(client, url, etags=None, params={**params, "page": p})
+                for p in range(2, last + 1)))
+            for p, rp in enumerate(resps, 2):
+                if rp.status_code == 304:
+                    log("info", f"{label}: page {p} not modified")
+                    return
+                if not rp.is_success:
+                    log("warn", f"{label}: HTTP {rp.status_code} on page {p}, stopping")
+                    return
+                d = orjson.loads(rp.content)
+                log("info", f"{label}: page {p}: got {len(d) if isinstance(d, list) else 0}")
+                if d:
+                    yield d
+            return
+        page += 1
+
+
 def log(level: str, msg: str):
     sys.stderr.write(f"[{level}] {msg}\n")
 
 
-def utc_now() -> str:
-    return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+def utc_now(ago: float = 0) -> str:
+    return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(time.time() - ago))
 
 
 def gh_headers() -> dict:
@@ -82,121 +294,216 @@ def gh_headers() -> dict:
     }
 
 # === cache ===
-simple_cache = {"commits": [], "issues": [], "orgs": {}, "repos": {}}
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS commits (sha TEXT PRIMARY KEY);
+CREATE TABLE IF NOT EXISTS issues  (key TEXT PRIMARY KEY);
+CREATE TABLE IF NOT EXISTS repo_state (repo TEXT PRIMARY KEY, state TEXT);
+CREATE TABLE IF NOT EXISTS orgs  (org TEXT PRIMARY KEY, repos TEXT, ts REAL);
+CREATE TABLE IF NOT EXISTS etags (url TEXT PRIMARY KEY, etag TEXT);
+CREATE TABLE IF NOT EXISTS user_json (login TEXT PRIMARY KEY, body BLOB);
+"""
 
-def load_cache() -> dict:
-    p = pathlib.Path(CACHE_FILE)
-    if p.exists():
-        try:
-            data = json.load(open(CACHE_FILE, encoding="utf-8"))
-            if isinstance(data, dict):
-                for k, v in simple_cache.items():
-                    data.setdefault(k, v.copy() if isinstance(v, list) else v)
-                return data
-        except Exception:
-            log("warn", f"Broken {CACHE_FILE}, resetting")
-    return {**simple_cache}
+
+def _migrate_json_cache(db: sqlite3.Connection):
+    """Разовый импорт старого cache.json в SQLite."""
+    try:
+        old = orjson.loads(pathlib.Path(CACHE_FILE).read_bytes())
+    except Exception:
+        log("warn", f"Broken {CACHE_FILE}, skipping migration")
+        return
+    if not isinstance(old, dict):
+        return
+    log("info", f"Migrating {CACHE_FILE} → {CACHE_DB}")
+    db.executemany("INSERT OR IGNORE INTO commits(sha) VALUES (?)",
+                   ((s,) for s in old.get("commits", [])))
+    db.executemany("INSERT OR IGNORE INTO issues(key) VALUES (?)",
+                   ((k,) for k in old.get("issues", [])))
+    db.executemany("REPLACE INTO orgs(org, repos, ts) VALUES (?, ?, ?)",
+                   ((o, orjson.dumps(m.get("repos", [])).decode(), m.get("ts", 0))
+                    for o, m in old.get("orgs", {}).items()))
+    db.executemany("REPLACE INTO repo_state(repo, state) VALUES (?, ?)",
+                   ((r, orjson.dumps(st).decode()) for r, st in old.get("repos", {}).items()))
+    db.executemany("REPLACE INTO etags(url, etag) VALUES (?, ?)",
+                   list(old.get("etags", {}).items()))
+    db.commit()
+
+
+def load_cache() -> tuple:
+    db = sqlite3.connect(CACHE_DB)
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute("PRAGMA synchronous=NORMAL")
+    db.executescript(_SCHEMA)
+    if db.execute("SELECT 1 FROM commits LIMIT 1").fetchone() is None \
+            and pathlib.Path(CACHE_FILE).exists():
+        _migrate_json_cache(db)
+    cache = {
+        # в памяти SHA живут как int: ~втрое компактнее 40-символьных str и быстрее хэшируются
+        "commits": {int(r[0], 16) for r in db.execute("SELECT sha FROM commits")},
+        "issues":  {r[0] for r in db.execute("SELECT key FROM issues")},
+        "orgs": {o: {"repos": orjson.loads(rs), "ts": ts}
+                 for o, rs, ts in db.execute("SELECT org, repos, ts FROM orgs")},
+        "repos": {r: orjson.loads(s) for r, s in db.execute("SELECT repo, state FROM repo_state")},
+        "etags": dict(db.execute("SELECT url, etag FROM etags")),
+    }
+    return db, cache
+
+
+def save_cache(db: sqlite3.Connection, cache: dict):
+    """commits/issues в cache — только дельта текущего запуска, не вся история."""
+    db.executemany("INSERT OR IGNORE INTO commits(sha) VALUES (?)",
+                   ((f"{s:040x}",) for s in cache["commits"]))
+    db.executemany("INSERT OR IGNORE INTO issues(key) VALUES (?)",
+                   ((k,) for k in cache["issues"]))
+    db.executemany("REPLACE INTO orgs(org, repos, ts) VALUES (?, ?, ?)",
+                   ((o, orjson.dumps(m.get("repos", [])).decode(), m.get("ts", 0))
+                    for o, m in cache["orgs"].items()))
+    db.executemany("REPLACE INTO repo_state(repo, state) VALUES (?, ?)",
+                   ((r, orjson.dumps(st).decode()) for r, st in cache["repos"].items()))
+    db.executemany("REPLACE INTO etags(url, etag) VALUES (?, ?)", list(ETAGS.items()))
+    db.commit()
 
 
-def save_cache(cache: dict):
-    json.dump(cache, open(CACHE_FILE, "w", encoding="utf-8"), indent=2, ensure_ascii=False)
+def _atomic_write(path: str, data: bytes):
+    """tmp-файл + fsync + os.replace: либо старая версия, либо целая новая."""
+    tmp = f"{path}.tmp.{os.getpid()}"
+    with open(tmp, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def load_leaderboard() -> dict:
+    """Стримим users из leaderboard.json через ijson — файл растёт без ограничений,
+    а так в памяти живёт по одному пользователю за раз вместо всего дерева."""
+    users = {}
+    p = pathlib.Path(OUTPUT_FILE)
+    if not p.exists():
+        return users
+    try:
+        with p.open("rb") as f:
+            for u in ijson.items(f, "users.item"):
+                users[u["login"]] = u
+    except Exception:
+        log("warn", f"Broken {OUTPUT_FILE}, starting fresh")
+        return {}
+    return users
 
 # === list org repos ===
-def org_repos_from_api(org: str) -> list:
-    repos, page = [], 1
-    while True:
-        log("info", f"[ORG] listing {org}, page {page}")
-        resp = safe_get(
-            f"https://api.github.com/orgs/{org}/repos",
-            headers=gh_headers(), params={"per_page": PER_PAGE, "page": page}, timeout=30
-        )
-        if resp.status_code == 404 or not resp.ok:
-            break
-        data = resp.json()
-        if not data:
-            break
+async def org_repos_from_api(client, org: str) -> list:
+    repos = []
+    async for data in paginate(client, f"https://api.github.com/orgs/{org}/repos",
+                               {}, f"[ORG] {org}"):
         repos += [f"{org}/{r['name']}" for r in data]
-        page += 1
-        time.sleep(0.1)
     return repos
 
 
-def get_repos_list(cache: dict) -> dict:
+async def get_repos_list(client, cache: dict) -> dict:
     cache.setdefault("orgs", {})
     cache.setdefault("repos", {})
     if not pathlib.Path(REPOS_FILE).exists():
         log("error", f"{REPOS_FILE} not found"); sys.exit(1)
-    cfg = json.load(open(REPOS_FILE, encoding="utf-8"))
+    with open(REPOS_FILE, encoding="utf-8") as f:
+        cfg = json.load(f)
     def norm(u: str):
         u = u.strip()
-        if u.startswith(("http://", "https://")):
-            p = urlparse(u); path = p.path.lstrip("/").rstrip("/")
-            return path[:-4] if path.endswith(".git") else path
-        return u or None
-    official = {x for x in (norm(x) for x in cfg.get("official", [])) if x}
-    unofficial = {x for x in (norm(x) for x in cfg.get("unofficial", [])) if x}
-    def expand(src: set) -> set:
-        out, now = set(), time.time()
+        m = _URL_RE.match(u)
+        return (m.group("path") if m else u) or None
+    official = {n for x in cfg.get("official", []) if (n := norm(x))}
+    unofficial = {n for x in cfg.get("unofficial", []) if (n := norm(x))}
+    async def expand(src: set) -> set:
+        out, now, stale = set(), time.time(), []
         for e in src:
             parts = e.split("/")
             if len(parts) == 1:
-                org, meta = e, cache["orgs"].get(e, {})
+                meta = cache["orgs"].get(e, {})
                 last, ts = meta.get("repos", []), meta.get("ts", 0)
                 if not last or now - ts > ORG_TTL:
-                    lst = org_repos_from_api(org)
-                    cache["orgs"][org] = {"repos": lst, "ts": now}
+                    stale.append((e, last))
                 else:
-                    lst = last
-                out.update(lst)
+                    out.update(last)
             elif len(parts) == 2:
                 out.add(e)
+        # протухшие организации листаем параллельно
+        for (org, last), fresh in zip(stale, await asyncio.gather(
+                *(org_repos_from_api(client, o) for o, _ in stale))):
+            # 304/пустой ответ или тот же состав — оставляем список, продлеваем TTL
+            lst = fresh if fresh and set(fresh) != set(last) else (last or fresh)
+            cache["orgs"][org] = {"repos": lst, "ts": now}
+            out.update(lst)
         return out
-    result = {r: True for r in expand(official)}
-    result.update({r: False for r in expand(unofficial)})
+    result = dict.fromkeys(await expand(official), True)
+    result.update(dict.fromkeys(await expand(unofficial), False))
     return result
 
 # === fetch commits ===
-def fetch_commits(repo: str, is_off: bool, st: dict, seen: set):
+def _author(c) -> str:
+    """Логин автора, если привязан аккаунт, иначе имя из метаданных коммита."""
+    a = c.get("author")
+    if a:
+        login = a.get("login")
+        if login:
+            return login
+    return c["commit"]["author"].get("name")
+
+
+async def fetch_commits(client, repo: str, is_off: bool, since, seen: set, etags: dict):
+    """Возвращает (записи, новые SHA). seen и глобальные ETag не трогает:
+    вызывающий код вливает новые ключи и etags только после того, как записи
+    попали в users, — иначе контрольная точка могла бы пометить SHA собранными
+    (или страницу неизменённой) раньше самих записей."""
     owner, name = repo.split("/"); base = f"https://github.com/{owner}/{name}"
-    page, since = st.get("c_page", 1), st.get("c_since")
-    log("info", f"[{repo}] commits since={since} page={page}")
-    while True:
-        params = {"per_page": PER_PAGE, "page": page}
-        if since: params["since"] = since
-        r = safe_get(f"https://api.github.com/repos/{repo}/commits", headers=gh_headers(), params=params, timeout=30)
-        data = r.json(); cnt = len(data) if isinstance(data, list) else 0
-        log("info", f"[{repo}] page {page}: got {cnt} commits")
-        if not data: break
+    log("info", f"[{repo}] commits since={since}")
+    out, new = [], set()
+
+    async def detail(sha):
+        # SHA попадает в seen и больше не запрашивается — ETag здесь никогда
+        # не сработает, только раздует etags на строку с полным URL на коммит
+        resp = await safe_get(client, f"https://api.github.com/repos/{repo}/commits/{sha}",
+                              etags=None)
+        return sha, orjson.loads(resp.content) or {}
+
+    params = {"since": since} if since else {}
+    async for data in paginate(client, f"https://api.github.com/repos/{repo}/commits",
+                               params, f"[{repo}] commits", etags):
+        fresh, hit_seen = [], False
         for c in data:
-            sha = c.get("sha");
-            if not sha or sha in seen: continue
-            det = safe_get(f"https://api.github.com/repos/{repo}/commits/{sha}", headers=gh_headers(), timeout=30).json()
-            files = [os.path.basename(f.get("filename", "")) for f in det.get("files", [])]
-            author = (c.get("author") or {}).get("login") or c["commit"]["author"].get("name")
+            sha = c.get("sha")
+            if not sha: continue
+            k = int(sha, 16)
+            if k in seen or k in new:
+                # страницы идут от новых к старым: всё дальше уже собрано в прошлые запуски
+                hit_seen = True
+                break
+            new.add(k); fresh.append(c)
+        dets = dict(await asyncio.gather(*(detail(c["sha"]) for c in fresh)))
+        for c in fresh:
+            sha = c["sha"]; det = dets.get(sha, {})
+            files = [f.get("filename", "").rpartition("/")[2] for f in det.get("files", [])]
+            author = _author(c)
             rec = {"sha": sha, "author": author, "url": f"{base}/commit/{sha}",
                    "repo": base, "date": c["commit"]["author"].get("date"),
                    "file_names": files, "is_official": is_off}
-            seen.add(sha); yield author, rec
-        page += 1; time.sleep(0.1)
-    st["c_page"], st["c_since"] = 1, utc_now()
+            out.append((author, rec))
+        if hit_seen:
+            break
+    return out, new
 
 # === fetch issues & PR ===
-def fetch_items(repo: str, is_off: bool, st: dict, seen: set):
+async def fetch_items(client, repo: str, is_off: bool, since, seen: set, etags: dict):
+    """Возвращает (записи, новые ключи repo#number); seen и глобальные ETag
+    не трогает — см. fetch_commits."""
     owner, name = repo.split("/"); base = f"https://github.com/{owner}/{name}"
-    page, since = st.get("i_page", 1), st.get("i_since")
-    log("info", f"[{repo}] issues since={since} page={page}")
-    while True:
-        params = {"state": "all", "per_page": PER_PAGE, "page": page}
-        if since: params["since"] = since
-        r = safe_get(f"https://api.github.com/repos/{repo}/issues", headers=gh_headers(), params=params, timeout=30)
-        data = r.json(); cnt = len(data) if isinstance(data, list) else 0
-        log("info", f"[{repo}] page {page}: got {cnt} issues/PR")
-        if not data: break
+    log("info", f"[{repo}] issues since={since}")
+    out, new = [], set()
+    params = {"state": "all", **({"since": since} if since else {})}
+    async for data in paginate(client, f"https://api.github.com/repos/{repo}/issues",
+                               params, f"[{repo}] issues", etags):
         for it in data:
-            author = it.get("user", {}).get("login");
+            author = it.get("user", {}).get("login")
             if not author: continue
             key = f"{repo}#{it.get('number')}"
-            if key in seen: continue
+            if key in seen or key in new: continue
             rec = {"number": it.get("number"),
                    "title": it.get("title"),
                    "url": it.get("html_url"),
@@ -205,40 +512,123 @@ def fetch_items(repo: str, is_off: bool, st: dict, seen: set):
                    "created_at": it.get("created_at"),
                    "is_official": is_off,
                    "type": "pull_request" if "pull_request" in it else "issue"}
-            seen.add(key); yield author, rec
-        page += 1; time.sleep(0.1)
-    st["i_page"], st["i_since"] = 1, utc_now()
+            new.add(key); out.append((author, rec))
+    return out, new
 
 # === main ===
-def main():
+class Users(dict):
+    """login → запись пользователя; новая запись создаётся из ключа при первом обращении.
+    dirty — логины, затронутые в этом запуске: только их нужно пересериализовывать."""
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.dirty = set()
+
+    def __missing__(self, login):
+        u = self[login] = {"login": login, "profile_url": f"https://github.com/{login}",
+                           "commits": [], "issues": [], "pull_requests": []}
+        return u
+
+
+def write_leaderboard(db: sqlite3.Connection, users: "Users"):
+    """Пишем leaderboard.json из кэша сериализованных записей (user_json):
+    перекодируются только пользователи с новой активностью. Если с прошлой
+    записи ничего не изменилось — файл не трогаем вовсе."""
+    cached = dict(db.execute("SELECT login, body FROM user_json"))
+    if not users.dirty and cached.keys() == users.keys() \
+            and pathlib.Path(OUTPUT_FILE).exists():
+        log("info", "Leaderboard unchanged, skipping rewrite")
+        return
+    rows, chunks = [], []
+    for login, u in users.items():
+        body = cached.get(login)
+        if body is None or login in users.dirty:
+            body = orjson.dumps(u)
+            rows.append((login, body))
+        chunks.append(body)
+    _atomic_write(OUTPUT_FILE, b'{"users": [\n' + b',\n'.join(chunks) + b'\n]}\n')
+    db.executemany("REPLACE INTO user_json(login, body) VALUES (?, ?)", rows)
+    # сброшенные логины считаем чистыми: следующая контрольная точка
+    # перекодирует только тех, кто получил активность после этой
+    users.dirty.clear()
+
+
+async def main():
     log("info", "Loading cache and existing leaderboard…")
-    cache = load_cache()
+    db, cache = load_cache()
+    ETAGS.update(cache.get("etags", {}))
     # merge previous leaderboard
-    prev = {}
-    if pathlib.Path(OUTPUT_FILE).exists():
-        try: prev = json.load(open(OUTPUT_FILE, encoding="utf-8"))
-        except: prev = {"users": []}
-    users_map = {u["login"]: u for u in prev.get("users", [])}
-    users = defaultdict(lambda: {"login": None, "profile_url": None, "commits": [], "issues": [], "pull_requests": []}, users_map)
-    log("info", "Building repository list…")
-    repos_map = get_repos_list(cache)
-    log("info", f"Total repos to process: {len(repos_map)}")
-    seen_shas, seen_issues = set(cache.get("commits", [])), set(cache.get("issues", []))
+    users = Users(load_leaderboard())
+    seen_shas, seen_issues = cache.pop("commits"), cache.pop("issues")
+    known_shas, known_issues = frozenset(seen_shas), frozenset(seen_issues)
     repo_state = cache.setdefault("repos", {})
-    for repo, is_off in repos_map.items():
-        log("info", f"--- Processing {repo} (official={is_off}) ---")
-        st = repo_state.setdefault(repo, {})
-        for author, cm in fetch_commits(repo, is_off, st, seen_shas):
-            u = users[author]; u["login"], u["profile_url"] = author, f"https://github.com/{author}"; u["commits"].append(cm)
-        for author, it in fetch_items(repo, is_off, st, seen_issues):
-            u = users[author]; u["login"], u["profile_url"] = author, f"https://github.com/{author}";
-            col = "pull_requests" if it["type"] == "pull_request" else "issues"; u[col].append(it)
-        log("info", f"[{repo}] done: commits={len(seen_shas)}, issues={len(seen_issues)}")
-    cache["commits"], cache["issues"] = list(seen_shas), list(seen_issues)
-    save_cache(cache)
-    out = {"users": list(users.values())}
-    json.dump(out, open(OUTPUT_FILE, "w", encoding="utf-8"), indent=2, ensure_ascii=False)
-    log("info", f"Done: total users={len(out['users'])}, commits={len(seen_shas)}, issues+PR={len(seen_issues)}")
+    repo_sem = asyncio.Semaphore(REPO_CONCURRENCY)
+    done = 0
+
+    def checkpoint():
+        # сначала leaderboard, потом кэш: SHA не должны считаться собранными раньше записей
+        cache["commits"], cache["issues"] = seen_shas - known_shas, seen_issues - known_issues
+        write_leaderboard(db, users)
+        save_cache(db, cache)
+
+    async def process_repo(client, repo: str, is_off: bool):
+        async with repo_sem:
+            log("info", f"--- Processing {repo} (official={is_off}) ---")
+            st = repo_state.setdefault(repo, {})
+            etags: dict = {}  # ETag этого репозитория до публикации в конце
+            # одна дешёвая проверка метаданных вместо двух обходов пагинации
+            meta = await safe_get(client, f"https://api.github.com/repos/{repo}", etags=etags)
+            if meta.status_code == 304 and st.get("c_since") and st.get("i_since"):
+                log("info", f"[{repo}] not modified, skipping")
+                return
+            pushed = orjson.loads(meta.content).get("pushed_at") if meta.status_code == 200 else None
+            if pushed and st.get("c_since") and pushed <= st["c_since"]:
+                log("info", f"[{repo}] no pushes since {st['c_since']}, skipping commits")
+                commits, c_new = [], set()
+                items, i_new = await fetch_items(client, repo, is_off, st.get("i_since"),
+                                                 seen_issues, etags)
+            else:
+                (commits, c_new), (items, i_new) = await asyncio.gather(
+                    fetch_commits(client, repo, is_off, st.get("c_since"), seen_shas, etags),
+                    fetch_items(client, repo, is_off, st.get("i_since"), seen_issues, etags))
+            for author, cm in commits:
+                if int(cm["sha"], 16) in seen_shas:
+                    # SHA успел засчитаться параллельным обходом форка/зеркала
+                    continue
+                users.dirty.add(author)
+                users[author]["commits"].append(cm)
+            for author, it in items:
+                if f"{repo}#{it['number']}" in seen_issues:
+                    continue
+                col = "pull_requests" if it["type"] == "pull_request" else "issues"
+                users.dirty.add(author)
+                users[author][col].append(it)
+            # ключи, ETag и курсоры фиксируем одним синхронным блоком уже после
+            # влития записей: контрольная точка из соседней корутины не увидит
+            # репозиторий наполовину
+            seen_shas.update(c_new)
+            seen_issues.update(i_new)
+            ETAGS.update(etags)
+            st["c_since"] = st["i_since"] = utc_now(SINCE_OVERLAP)
+            log("info", f"[{repo}] done: commits={len(seen_shas)}, issues={len(seen_issues)}")
+            nonlocal done
+            done += 1
+            if done % CHECKPOINT_EVERY == 0:
+                log("info", f"Checkpoint after {done} repos")
+                checkpoint()
+
+    async with httpx.AsyncClient(
+        http2=True, headers=gh_headers(), timeout=30,
+        limits=httpx.Limits(max_connections=32, max_keepalive_connections=32, keepalive_expiry=60)
+    ) as client:
+        log("info", "Building repository list…")
+        repos_map = await get_repos_list(client, cache)
+        log("info", f"Total repos to process: {len(repos_map)}")
+        await asyncio.gather(*(process_repo(client, r, o) for r, o in repos_map.items()))
+
+    checkpoint()
+    db.close()
+    log("info", f"Done: total users={len(users)}, commits={len(seen_shas)}, issues+PR={len(seen_issues)}")
 
 if __name__ == "__main__":
-    main()
+    asyncio.run(main())